@@ -1,7 +1,8 @@
 # app/celery_worker.py
-from celery import Celery
+from celery import Celery, group
+from celery.signals import worker_process_shutdown
 from .config import settings
-from .services import process_url_content
+from .services import process_url_content, shutdown_encode_pool
 import logging
 
 # Configure logging
@@ -15,11 +16,42 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_track_started=True
+    task_track_started=True,
+    # Ack after the work finishes so a crashed worker's task is redelivered
+    # instead of lost.
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # Ingestions vary wildly in duration; don't let one slow URL hold
+    # prefetched tasks hostage behind it.
+    worker_prefetch_multiplier=1,
+    # Shrink result-backend traffic and don't keep results forever.
+    result_compression='gzip',
+    result_expires=3600,
+    # With a Redis broker, tasks still running past the visibility timeout
+    # get redelivered; keep it above the slowest expected ingestion.
+    broker_transport_options={'visibility_timeout': 3600},
 )
 
+# worker_process_shutdown fires in the process that executed tasks (the
+# worker itself under --pool=solo), which is the only place the lazily
+# started encode pool can exist.
+@worker_process_shutdown.connect
+def close_encode_pool(**kwargs):
+    shutdown_encode_pool()
+
 @celery_app.task(name="process_ingestion_task")
 def process_ingestion_task(document_id: str, url: str):
     logger.info(f"Starting ingestion task for document_id: {document_id}, url: {url}")
     process_url_content(document_id, url)
-    logger.info(f"Finished ingestion task for document_id: {document_id}")
\ No newline at end of file
+    logger.info(f"Finished ingestion task for document_id: {document_id}")
+
+def dispatch_ingestion_tasks(jobs: list[tuple[str, str]]):
+    """Queues many (document_id, url) ingestion tasks in one batched dispatch.
+
+    Sending a group lets kombu pipeline the underlying Redis LPUSHes instead
+    of paying one broker round-trip per .delay() call.
+    """
+    if not jobs:
+        return
+    group(process_ingestion_task.s(document_id, url) for document_id, url in jobs).apply_async()
+    logger.info(f"Dispatched {len(jobs)} ingestion tasks as one group.")
\ No newline at end of file
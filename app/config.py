@@ -10,15 +10,29 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str
     POSTGRES_PORT: int
 
+    # Connection pool tuning; raise DB_POOL_SIZE with worker fleet size.
+    # When pooling is delegated to PgBouncer, point POSTGRES_PORT at it
+    # (usually 6432) and keep these small.
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_RECYCLE: int = 1800
+
     REDIS_HOST: str
     REDIS_PORT: int
 
     QDRANT_HOST: str
     QDRANT_PORT: int
+    QDRANT_GRPC_PORT: int = 6334
     
     # Updated for Groq and local embeddings
     GROQ_API_KEY: str
     EMBEDDING_MODEL_NAME: str = "all-MiniLM-L6-v2"
+    EMBEDDING_DEVICE: str = "auto"  # "auto", "cuda" or "cpu"
+    EMBEDDING_BACKEND: str = "torch"  # "torch" or "onnx" (int8-quantized, CPU only)
+    # torch.compile the encoder (torch backend only). Faster steady-state
+    # encode, but adds tens of seconds of one-off compile time at startup.
+    EMBEDDING_COMPILE: bool = False
     GENERATIVE_MODEL_NAME: str = "openai/gpt-oss-20b"
 
     @property
@@ -2,13 +2,37 @@
 import enum
 from sqlalchemy import create_engine, Column, String, Enum, Text, DateTime
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from datetime import datetime, timezone
 from .config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+# Sync engine: used by the Celery worker and for table creation.
+# pool_pre_ping drops connections killed by container restarts instead of
+# surfacing them as 500s; pool_recycle avoids server-side idle timeouts.
+engine = create_engine(
+    settings.DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine: used by the FastAPI endpoints so DB round-trips don't occupy
+# a thread from the framework's bounded threadpool.
+async_engine = create_async_engine(
+    settings.DATABASE_URL.replace("psycopg2", "asyncpg"),
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 Base = declarative_base()
 
 class IngestionStatus(enum.Enum):
@@ -26,12 +50,9 @@ class Document(Base):
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
\ No newline at end of file
@@ -1,6 +1,10 @@
 # app/main.py
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import schemas, database, services, celery_worker
 import uuid
 
@@ -13,42 +17,108 @@ services.setup_qdrant_collection()
 app = FastAPI(title="Web-Aware RAG Engine", version="1.0.0")
 
 @app.post("/ingest-url", status_code=202, response_model=schemas.IngestResponse)
-def ingest_url(request: schemas.IngestRequest, req: Request, db: Session = Depends(database.get_db)):
+async def ingest_url(request: schemas.IngestRequest, req: Request, db: AsyncSession = Depends(database.get_db)):
     """Accepts a URL and queues it for background ingestion."""
-    # Check for existing URL
-    existing_doc = db.query(database.Document).filter(database.Document.source_url == str(request.url)).first()
-    if existing_doc:
+    # Insert and duplicate-check in one statement: ON CONFLICT DO NOTHING
+    # returns no row for an already-submitted URL, which also closes the race
+    # where two concurrent submissions both pass a separate SELECT check.
+    stmt = (
+        pg_insert(database.Document)
+        .values(source_url=str(request.url))
+        .on_conflict_do_nothing(index_elements=["source_url"])
+        .returning(database.Document.id)
+    )
+    new_doc_id = (await db.execute(stmt)).scalar_one_or_none()
+    await db.commit()
+    if new_doc_id is None:
         raise HTTPException(status_code=409, detail="This URL has already been submitted.")
 
-    new_doc = database.Document(source_url=str(request.url))
-    db.add(new_doc)
-    db.commit()
-    db.refresh(new_doc)
-
     # Dispatch task to Celery
-    celery_worker.process_ingestion_task.delay(str(new_doc.id), str(request.url))
-    
-    status_url = req.url_for('get_ingestion_status', document_id=new_doc.id)
-    
+    celery_worker.process_ingestion_task.delay(str(new_doc_id), str(request.url))
+
+    status_url = req.url_for('get_ingestion_status', document_id=new_doc_id)
+
     return {
         "message": "URL accepted for ingestion.",
-        "document_id": new_doc.id,
+        "document_id": new_doc_id,
         "status_endpoint": str(status_url)
     }
 
+@app.post("/ingest-urls", status_code=202, response_model=schemas.IngestBulkResponse)
+async def ingest_urls(request: schemas.IngestBulkRequest, db: AsyncSession = Depends(database.get_db)):
+    """Accepts a batch of URLs and queues the previously unseen ones for ingestion."""
+    urls = list(dict.fromkeys(str(u) for u in request.urls))
+    if not urls:
+        raise HTTPException(status_code=400, detail="No URLs provided.")
+
+    # One multi-row insert; already-submitted URLs simply return no row.
+    stmt = (
+        pg_insert(database.Document)
+        .values([{"source_url": u} for u in urls])
+        .on_conflict_do_nothing(index_elements=["source_url"])
+        .returning(database.Document.id, database.Document.source_url)
+    )
+    accepted = {url: doc_id for doc_id, url in (await db.execute(stmt)).all()}
+    await db.commit()
+
+    # Publishing the whole group is a synchronous broker round-trip that
+    # grows with batch size, so keep it off the event loop.
+    await run_in_threadpool(
+        celery_worker.dispatch_ingestion_tasks,
+        [(str(doc_id), url) for url, doc_id in accepted.items()],
+    )
+
+    return {
+        "message": f"{len(accepted)} of {len(urls)} URLs accepted for ingestion.",
+        "document_ids": list(accepted.values()),
+        "skipped_urls": [u for u in urls if u not in accepted],
+    }
+
 @app.get("/status/{document_id}", response_model=schemas.DocumentStatus)
-def get_ingestion_status(document_id: uuid.UUID, db: Session = Depends(database.get_db)):
+async def get_ingestion_status(document_id: uuid.UUID, db: AsyncSession = Depends(database.get_db)):
     """Retrieves the ingestion status of a specific document."""
-    doc = db.query(database.Document).filter(database.Document.id == document_id).first()
+    result = await db.execute(
+        select(database.Document).where(database.Document.id == document_id)
+    )
+    doc = result.scalar_one_or_none()
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found.")
     return doc
 
-@app.post("/query", response_model=schemas.QueryResponse)
-def query_knowledge_base(request: schemas.QueryRequest):
-    """Queries the knowledge base to get a grounded answer."""
+def _format_sse(tokens):
+    """Frames raw token strings as Server-Sent Events.
+
+    SSE clients discard lines without a "data:" field, so each token is
+    wrapped as a data event (multi-line tokens become multiple data lines of
+    one event) and the stream is terminated with a [DONE] sentinel.
+    """
+    for token in tokens:
+        if not token:
+            continue
+        data = "\n".join(f"data: {line}" for line in token.split("\n"))
+        yield f"{data}\n\n"
+    yield "data: [DONE]\n\n"
+
+@app.post("/query")
+async def query_knowledge_base(request: schemas.QueryRequest):
+    """Queries the knowledge base and streams the grounded answer token-by-token."""
+    if not request.question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+
+    # The sync generator is iterated in the threadpool by Starlette, so the
+    # event loop is never blocked on the model or Groq.
+    return StreamingResponse(
+        _format_sse(services.perform_query_stream(request.question, request.top_k)),
+        media_type="text/event-stream",
+    )
+
+@app.post("/query-json", response_model=schemas.QueryResponse)
+async def query_knowledge_base_json(request: schemas.QueryRequest):
+    """Non-streaming variant for clients that want the answer plus context chunks."""
     if not request.question:
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
-    
-    result = services.perform_query(request.question, request.top_k)
+
+    # perform_query calls sync clients (embedding model, Qdrant, Groq), so
+    # run it in the threadpool instead of blocking the event loop.
+    result = await run_in_threadpool(services.perform_query, request.question, request.top_k)
     return result
\ No newline at end of file
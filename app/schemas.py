@@ -11,6 +11,14 @@ class IngestResponse(BaseModel):
     document_id: uuid.UUID
     status_endpoint: str
     
+class IngestBulkRequest(BaseModel):
+    urls: List[HttpUrl]
+
+class IngestBulkResponse(BaseModel):
+    message: str
+    document_ids: List[uuid.UUID]
+    skipped_urls: List[str]
+
 class DocumentStatus(BaseModel):
     document_id: uuid.UUID
     status: str
@@ -1,5 +1,14 @@
 ## app/services.py
+import functools
 import logging
+import multiprocessing
+import os
+from pathlib import Path
+import tempfile
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter, Retry
+import torch
 from newspaper import Article
 from qdrant_client import QdrantClient, models
 from sqlalchemy.orm import Session
@@ -14,13 +23,123 @@ from .database import SessionLocal, Document, IngestionStatus
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OnnxEmbeddingModel:
+    """Int8-quantized ONNX Runtime replacement for SentenceTransformer on CPU.
+
+    Exposes the same `.encode` / `.get_sentence_embedding_dimension` surface
+    as SentenceTransformer so the rest of this module doesn't care which
+    backend is active. Dynamic int8 quantization targeting VNNI gives ~4x
+    encode throughput on CPU-only workers.
+    """
+
+    def __init__(self, model_name: str):
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        # Bare names like "all-MiniLM-L6-v2" are shorthand for the
+        # sentence-transformers org on the HF hub.
+        hf_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        onnx_dir = Path(tempfile.gettempdir()) / f"onnx_{model_name.replace('/', '_')}_int8"
+
+        if not (onnx_dir / "model_quantized.onnx").exists():
+            logger.info(f"Exporting {hf_name} to int8 ONNX at {onnx_dir}")
+            exported = ORTModelForFeatureExtraction.from_pretrained(hf_name, export=True)
+            exported.save_pretrained(onnx_dir)
+            quantizer = ORTQuantizer.from_pretrained(onnx_dir)
+            quantizer.quantize(
+                save_dir=onnx_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False),
+            )
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            onnx_dir, file_name="model_quantized.onnx"
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(hf_name)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.config.hidden_size
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = True, **_):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        batches = []
+        for i in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(
+                texts[i:i + batch_size],
+                padding=True, truncation=True, return_tensors="np",
+            )
+            hidden = self.model(**encoded).last_hidden_state
+            # Mean-pool over the attention mask, matching SentenceTransformer.
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            batches.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+        embeddings = np.concatenate(batches).astype(np.float32)
+        if normalize_embeddings:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings[0] if single else embeddings
+
 # 1. Initialize the local sentence-transformer model
 # This model will be downloaded automatically the first time it's used.
-logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_NAME}")
-embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME)
+if settings.EMBEDDING_DEVICE == "auto":
+    EMBEDDING_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+else:
+    EMBEDDING_DEVICE = settings.EMBEDDING_DEVICE
+
+if EMBEDDING_DEVICE == "cpu":
+    # Forked Celery workers can come up with a single intra-op thread,
+    # leaving cores idle during the MatMul-bound encode. Split the cores
+    # across concurrent workers so N workers don't oversubscribe MKL/OMP.
+    _concurrency = max(1, int(os.environ.get("CELERY_CONCURRENCY", "1")))
+    _num_threads = max(1, (os.cpu_count() or 1) // _concurrency)
+    torch.set_num_threads(_num_threads)
+    logger.info(f"Using {_num_threads} intra-op torch threads on CPU.")
+
+if settings.EMBEDDING_BACKEND == "onnx":
+    EMBEDDING_DEVICE = "cpu"  # the ONNX path is CPU-only
+    logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_NAME} (int8 ONNX)")
+    embedding_model = OnnxEmbeddingModel(settings.EMBEDDING_MODEL_NAME)
+else:
+    logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_NAME} on {EMBEDDING_DEVICE}")
+    embedding_model = SentenceTransformer(settings.EMBEDDING_MODEL_NAME, device=EMBEDDING_DEVICE)
+    if EMBEDDING_DEVICE == "cuda":
+        # FP16 halves memory bandwidth on the transformer matmuls; CPU hosts
+        # stay on float32 for accuracy and because CPU FP16 is slower.
+        embedding_model.half()
 EMBEDDING_DIMENSION = embedding_model.get_sentence_embedding_dimension()
 logger.info(f"Embedding model loaded. Vector dimension: {EMBEDDING_DIMENSION}")
 
+def encode_texts(texts, **kwargs):
+    """Encodes text through the embedding model with device-appropriate settings.
+
+    Always returns a contiguous float32 numpy array (never a Python list and
+    never FP16, even when the model itself runs in half precision), so the
+    result can flow into the Qdrant gRPC client without conversion.
+    """
+    kwargs.setdefault("convert_to_numpy", True)
+    kwargs.setdefault("normalize_embeddings", True)
+    kwargs.setdefault("show_progress_bar", False)
+    with torch.inference_mode():
+        if EMBEDDING_DEVICE == "cuda":
+            with torch.autocast("cuda", dtype=torch.float16):
+                embeddings = embedding_model.encode(texts, **kwargs)
+        else:
+            embeddings = embedding_model.encode(texts, **kwargs)
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+if settings.EMBEDDING_BACKEND == "torch" and settings.EMBEDDING_COMPILE:
+    try:
+        # Fuses MiniLM's many small kernels and removes per-layer Python
+        # dispatch. The warmup encode pays the compile cost at startup
+        # instead of on the first real request.
+        embedding_model[0].auto_model = torch.compile(
+            embedding_model[0].auto_model, mode="reduce-overhead", fullgraph=False
+        )
+        encode_texts(["warmup"])
+        logger.info("Embedding model compiled with torch.compile.")
+    except Exception as e:
+        logger.warning(f"torch.compile failed, continuing in eager mode: {e}")
+
 # 2. Initialize the Groq client
 try:
     groq_client = Groq(api_key=settings.GROQ_API_KEY)
@@ -29,8 +148,31 @@ except Exception as e:
     logger.error(f"Failed to configure Groq client: {e}")
 
 # 3. Initialize the Qdrant client
-qdrant_client = QdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+# gRPC keeps a persistent HTTP/2 connection and ships vectors as compact
+# protobuf instead of JSON floats.
+qdrant_client = QdrantClient(
+    host=settings.QDRANT_HOST,
+    port=settings.QDRANT_PORT,
+    grpc_port=settings.QDRANT_GRPC_PORT,
+    prefer_grpc=True,
+)
 QDRANT_COLLECTION_NAME = "web_content"
+EMBEDDING_BATCH_SIZE = 64
+# Below this many chunks, multi-process encode overhead outweighs the win.
+MULTI_PROCESS_CHUNK_THRESHOLD = 64
+# Namespace for deterministic point IDs derived from (document_id, chunk index).
+POINT_ID_NAMESPACE = uuid.NAMESPACE_URL
+
+# 4. Shared HTTP session for scraping. Keep-alive and TLS session reuse save
+# a fresh TCP+TLS handshake per URL when a worker processes many of them.
+http_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+http_session.mount("https://", _adapter)
+http_session.mount("http://", _adapter)
 
 # --- Helper Functions ---
 def setup_qdrant_collection():
@@ -44,21 +186,41 @@ def setup_qdrant_collection():
             collection_name=QDRANT_COLLECTION_NAME,
             vectors_config=models.VectorParams(
                 size=EMBEDDING_DIMENSION,  # Use the dimension from our local model
-                distance=models.Distance.COSINE
+                # Embeddings are normalized at encode time, so dot product is
+                # equivalent to cosine but cheaper to compute.
+                distance=models.Distance.DOT
+            ),
+            # m=24 trades a little index size for noticeably better recall/QPS
+            # than the default m=16 at our 384-dim scale.
+            hnsw_config=models.HnswConfigDiff(m=24, ef_construct=128),
+            # int8 scalar quantization keeps a 4x-smaller copy of the vectors
+            # in RAM for the search hot path; originals stay on disk for
+            # rescoring.
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                )
             ),
         )
+        # Index the payload fields we filter on. Without an index Qdrant
+        # falls back to post-filtering, which degrades badly as the
+        # collection grows; with it, document-scoped queries can
+        # filter-then-ANN.
+        for field_name in ("document_id", "url"):
+            qdrant_client.create_payload_index(
+                collection_name=QDRANT_COLLECTION_NAME,
+                field_name=field_name,
+                field_schema=models.PayloadSchemaType.KEYWORD,
+            )
         logger.info("Collection created successfully.")
 
 def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 100) -> list[str]:
-    # (No changes to this function)
+    """Splits text into overlapping fixed-size chunks with a single pass of slices."""
     if not text: return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - chunk_overlap
-    return chunks
+    step = chunk_size - chunk_overlap
+    return [text[start:start + chunk_size] for start in range(0, len(text), step)]
 
 # --- Core Service Logic ---
 def process_url_content(document_id: str, url: str):
@@ -72,8 +234,10 @@ def process_url_content(document_id: str, url: str):
 
         # 2. Scrape and clean content
         logger.info(f"[{document_id}] Scraping URL: {url}")
+        response = http_session.get(url, timeout=15)
+        response.raise_for_status()
         article = Article(url)
-        article.download()
+        article.set_html(response.text)
         article.parse()
         content = article.text
         if not content: raise ValueError("Failed to extract content from URL.")
@@ -82,23 +246,64 @@ def process_url_content(document_id: str, url: str):
         text_chunks = chunk_text(content)
         logger.info(f"[{document_id}] Text split into {len(text_chunks)} chunks.")
 
-        # 4. Embed chunks using the LOCAL model
-        embeddings = embedding_model.encode(text_chunks, show_progress_bar=True).tolist()
-        logger.info(f"[{document_id}] Generated {len(embeddings)} embeddings locally.")
+        # 4 & 5. Embed and store in fixed-size batches. Streaming each batch
+        # to Qdrant with wait=False lets the network transfer of one batch
+        # overlap with the encoding of the next instead of blocking on one
+        # large encode followed by one large upsert.
+        # Sorting by length first means each mini-batch contains chunks of
+        # similar size, so the tokenizer pads far less. Each point carries its
+        # own payload, so the upsert order does not matter.
+        order = sorted(range(len(text_chunks)), key=lambda i: len(text_chunks[i]))
+        sorted_chunks = [text_chunks[i] for i in order]
 
-        # 5. Store in Qdrant
-        qdrant_client.upsert(
-            collection_name=QDRANT_COLLECTION_NAME,
-            points=[
-                models.PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=embedding,
-                    payload={"text": chunk, "document_id": document_id, "url": url}
-                )
-                for i, (chunk, embedding) in enumerate(zip(text_chunks, embeddings))
-            ]
-        )
-        logger.info(f"[{document_id}] Upserted {len(embeddings)} points to Qdrant.")
+        # Large ingestions on a multi-core CPU host shard the encode across
+        # a process pool; small ones stay in-process where pool dispatch
+        # overhead would dominate. Daemonized prefork (billiard) children
+        # are not allowed to spawn the pool's processes, so under a prefork
+        # Celery pool we also stay in-process — the shipped compose file
+        # runs the worker with --pool=solo, where spawning is fine.
+        pooled_vectors = None
+        if (EMBEDDING_DEVICE == "cpu"
+                and settings.EMBEDDING_BACKEND == "torch"
+                and len(sorted_chunks) > MULTI_PROCESS_CHUNK_THRESHOLD
+                and not multiprocessing.current_process().daemon):
+            pooled_vectors = embedding_model.encode_multi_process(
+                sorted_chunks,
+                _get_encode_pool(),
+                batch_size=32,
+                normalize_embeddings=True,
+            )
+            pooled_vectors = np.ascontiguousarray(pooled_vectors, dtype=np.float32)
+
+        total_points = 0
+        for i in range(0, len(sorted_chunks), EMBEDDING_BATCH_SIZE):
+            batch = sorted_chunks[i:i + EMBEDDING_BATCH_SIZE]
+            if pooled_vectors is not None:
+                vectors = pooled_vectors[i:i + EMBEDDING_BATCH_SIZE]
+            else:
+                vectors = encode_texts(batch, batch_size=EMBEDDING_BATCH_SIZE)
+            # UUIDv5 keyed on (document_id, original chunk index) makes the
+            # upsert idempotent: re-ingesting or retrying a URL overwrites
+            # the same points instead of accumulating duplicates.
+            # Columnar Batch: one pydantic validation for the whole batch
+            # instead of one PointStruct object per chunk.
+            qdrant_client.upsert(
+                collection_name=QDRANT_COLLECTION_NAME,
+                points=models.Batch(
+                    ids=[
+                        str(uuid.uuid5(POINT_ID_NAMESPACE, f"{document_id}:{chunk_index}"))
+                        for chunk_index in order[i:i + EMBEDDING_BATCH_SIZE]
+                    ],
+                    vectors=vectors,
+                    payloads=[
+                        {"text": chunk, "document_id": document_id, "url": url}
+                        for chunk in batch
+                    ],
+                ),
+                wait=False,
+            )
+            total_points += len(batch)
+        logger.info(f"[{document_id}] Upserted {total_points} points to Qdrant.")
 
         # 6. Update status to COMPLETED
         doc.status = IngestionStatus.COMPLETED
@@ -114,44 +319,110 @@ def process_url_content(document_id: str, url: str):
     finally:
         db.close()
 
-def perform_query(question: str, top_k: int):
-    """Performs semantic search and generates a grounded answer using Groq."""
-    # 1. Embed the query using the LOCAL model
-    query_vector = embedding_model.encode(question).tolist()
+_encode_pool = None
+
+def _get_encode_pool():
+    """Lazily starts the multi-process encode pool (CPU torch backend only).
+
+    Each pool worker loads the model once and shards the input, scaling the
+    encode near-linearly across cores for large ingestions.
+    """
+    global _encode_pool
+    if _encode_pool is None:
+        target_devices = ["cpu"] * min(4, os.cpu_count() or 1)
+        logger.info(f"Starting encode pool with {len(target_devices)} CPU workers.")
+        _encode_pool = embedding_model.start_multi_process_pool(target_devices=target_devices)
+    return _encode_pool
+
+def shutdown_encode_pool():
+    """Stops the encode pool if one was started; hooked to Celery worker shutdown."""
+    global _encode_pool
+    if _encode_pool is not None:
+        embedding_model.stop_multi_process_pool(_encode_pool)
+        _encode_pool = None
+
+@functools.lru_cache(maxsize=1024)
+def _embed_query(question: str) -> tuple:
+    """Caches query embeddings; repeated questions skip the model entirely.
 
-    # 2. Search Qdrant for relevant chunks
-    search_results = qdrant_client.search(
+    Stored as a tuple because lru_cache values should be immutable. This is
+    per-process — a multi-process API deployment wanting a shared cache
+    should move this to Redis instead.
+    """
+    return tuple(encode_texts(question).tolist())
+
+NO_CONTEXT_ANSWER = "I could not find any relevant information in the knowledge base."
+
+def _retrieve_context(question: str, top_k: int) -> list[dict]:
+    """Embeds the question (cached for repeats) and fetches the top-k chunks.
+
+    query_points is the current API (search is deprecated) and performs the
+    quantized search plus the full-precision rescore of the oversampled
+    shortlist in a single RPC.
+    """
+    query_vector = np.asarray(_embed_query(question), dtype=np.float32)
+    search_results = qdrant_client.query_points(
         collection_name=QDRANT_COLLECTION_NAME,
-        query_vector=query_vector,
+        query=query_vector,
         limit=top_k,
-        with_payload=True
+        with_payload=True,
+        search_params=models.SearchParams(
+            hnsw_ef=128,
+            quantization=models.QuantizationSearchParams(
+                ignore=False, rescore=True, oversampling=3.0
+            ),
+        ),
     )
-    
-    context_chunks = [
+    return [
         {"text": point.payload['text'], "url": point.payload['url'], "score": point.score}
-        for point in search_results
+        for point in search_results.points
+    ]
+
+def _grounded_messages(question: str, context_chunks: list[dict]) -> list[dict]:
+    context_str = "\n---\n".join(chunk['text'] for chunk in context_chunks)
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful AI assistant. Answer the user's question based ONLY on the context provided. If the context does not contain the answer, state that you cannot answer the question with the given information."
+        },
+        {
+            "role": "user",
+            "content": f"CONTEXT:\n{context_str}\n\nQUESTION:\n{question}"
+        }
     ]
 
+def perform_query(question: str, top_k: int):
+    """Performs semantic search and generates a grounded answer using Groq."""
+    context_chunks = _retrieve_context(question, top_k)
+
     if not context_chunks:
-        return {"answer": "I could not find any relevant information in the knowledge base.", "context": []}
+        return {"answer": NO_CONTEXT_ANSWER, "context": []}
 
-    # 3. Generate a grounded answer with Groq
-    context_str = "\n---\n".join([chunk['text'] for chunk in context_chunks])
-    
     chat_completion = groq_client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a helpful AI assistant. Answer the user's question based ONLY on the context provided. If the context does not contain the answer, state that you cannot answer the question with the given information."
-            },
-            {
-                "role": "user",
-                "content": f"CONTEXT:\n{context_str}\n\nQUESTION:\n{question}"
-            }
-        ],
+        messages=_grounded_messages(question, context_chunks),
         model=settings.GENERATIVE_MODEL_NAME,
     )
-    
+
     answer = chat_completion.choices[0].message.content
-    
-    return {"answer": answer, "context": context_chunks}
\ No newline at end of file
+
+    return {"answer": answer, "context": context_chunks}
+
+def perform_query_stream(question: str, top_k: int):
+    """Like perform_query, but yields answer tokens as Groq produces them.
+
+    Time-to-first-byte drops to roughly one round-trip instead of waiting
+    for the full generation to finish.
+    """
+    context_chunks = _retrieve_context(question, top_k)
+
+    if not context_chunks:
+        yield NO_CONTEXT_ANSWER
+        return
+
+    stream = groq_client.chat.completions.create(
+        messages=_grounded_messages(question, context_chunks),
+        model=settings.GENERATIVE_MODEL_NAME,
+        stream=True,
+    )
+    for chunk in stream:
+        yield chunk.choices[0].delta.content or ""
\ No newline at end of file